@@ -1,22 +1,40 @@
 """FastAPI chat service with a LangGraph ReAct agent using only the Tavily search tool."""
 
+import asyncio
+import atexit
+import hashlib
+import hmac
+import logging
+import logging.handlers
+import operator
 import os
-from typing import Any, Optional
+import queue
+import re
+import secrets
+import sys
+import textwrap
+import threading
+import time
+from typing import Any, AsyncIterator, Optional
 from uuid import uuid4
 
+import ahocorasick
+from cachetools import TTLCache
 from dotenv import load_dotenv
 from fastapi import Depends, FastAPI, Header, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import ORJSONResponse, StreamingResponse
+import httpx
+from pydantic import BaseModel, Field
+import numpy as np
+import orjson
 
 from langgraph.prebuilt import create_react_agent
-from langchain_openai import ChatOpenAI
+from langchain_openai import ChatOpenAI, OpenAIEmbeddings
 from langchain_core.tools import tool
 from langfuse import Langfuse, get_client
 from langfuse.langchain import CallbackHandler
 
-from tavily import TavilyClient
-
 from guardrails import Guard, OnFailAction
 from guardrails.hub import ReadingTime, RestrictToTopic
 from guardrails import Guard, OnFailAction, register_validator
@@ -27,6 +45,17 @@ from guardrails.validator_base import PassResult, FailResult, ValidationResult
 load_dotenv()
 
 
+# Log records are queued and written to stdout by a background thread, keeping I/O off the event loop
+_log_queue: queue.Queue = queue.Queue()
+logger = logging.getLogger("agent_service")
+logger.setLevel(logging.INFO)
+logger.addHandler(logging.handlers.QueueHandler(_log_queue))
+logger.propagate = False
+_log_listener = logging.handlers.QueueListener(_log_queue, logging.StreamHandler(sys.stdout))
+_log_listener.start()
+atexit.register(_log_listener.stop)
+
+
 # Pydantic python data models to ensure data integrity and validity
 class ChatRequest(BaseModel):
     message: str
@@ -40,6 +69,20 @@ class ChatResponse(BaseModel):
     session_id: str
 
 
+# Limits for /chat/batch so one request cannot fan out into unbounded agent runs
+BATCH_MAX_MESSAGES = 20
+BATCH_CONCURRENCY = 4
+
+
+class BatchChatRequest(BaseModel):
+    messages: list[str] = Field(min_length=1, max_length=BATCH_MAX_MESSAGES)
+    session_id: Optional[str] = None
+
+
+class BatchChatResponse(BaseModel):
+    responses: list[ChatResponse]
+
+
 class LoginRequest(BaseModel):
     username: str
     password: str
@@ -51,7 +94,11 @@ class LoginResponse(BaseModel):
 
 
 # Initializes the FastAPI
-app = FastAPI(title="Class 5 Agent API", description="ReAct agent with tool access and monitoring.")
+app = FastAPI(
+    title="Class 5 Agent API",
+    description="ReAct agent with tool access and monitoring.",
+    default_response_class=ORJSONResponse,
+)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -59,7 +106,10 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
-app.state.active_tokens: dict[str, str] = {}
+# Tokens expire after an hour and the store is capped so it cannot grow forever
+app.state.active_tokens: TTLCache = TTLCache(maxsize=10_000, ttl=3600)
+# TTLCache is not thread-safe and login/verify_token run on threadpool threads
+app.state.active_tokens_lock = threading.Lock()
 
 # --- Setup helpers ---------------------------------------------------------
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
@@ -73,43 +123,109 @@ AGENT_API_USERNAME = os.getenv("AGENT_API_USERNAME")
 AGENT_API_PASSWORD = os.getenv("AGENT_API_PASSWORD")
 TAVILY_API_KEY = os.getenv("TAVILY_API_KEY")
 
+# Digests of the configured credentials, compared in constant time on login
+_USER_DIGEST = hashlib.sha256(AGENT_API_USERNAME.encode()).digest() if AGENT_API_USERNAME else None
+_PWD_DIGEST = hashlib.sha256(AGENT_API_PASSWORD.encode()).digest() if AGENT_API_PASSWORD else None
+
 if not AGENT_API_USERNAME or not AGENT_API_PASSWORD:
-    print("[Auth] Warning: AGENT_API_USERNAME or AGENT_API_PASSWORD is missing. Login will fail until both are set.")
+    logger.warning("[Auth] AGENT_API_USERNAME or AGENT_API_PASSWORD is missing. Login will fail until both are set.")
+
+# Langfuse client built once; the SDK batches span export in the background (default
+# flush_at=512, flush_interval=5s) and flushes on exit, so requests never flush it
+langfuse = Langfuse(
+    public_key=LANGFUSE_PUBLIC,
+    secret_key=LANGFUSE_SECRET,
+    host=LANGFUSE_HOST,
+    environment=LANGFUSE_ENV,
+)
+
+
+SYSTEM_PROMPT = textwrap.dedent("""
+    You are a deployment assistant for Class 6 demos.
+    Explain environment setup, FastAPI backend deployment, and Streamlit UI integration clearly.
+    Use the Tavily search tool for recent context and cite sources when useful.
+""").strip()
 
 
 # --- Guardrail Functions ------------------------------------------------------
-def apply_reading_time_guardrail(response_text: str):
-    """Ensure the assistant's response can be read in under 90 seconds."""
-    FIFTEEN_SECONDS = 90 / 60  # reading_time is in minutes
-    guard = Guard().use(
-        ReadingTime,
-        reading_time=FIFTEEN_SECONDS,
+# Replies returned in place of the agent answer when a guardrail is triggered
+DARKWEB_GUARD_REPLY = (
+    "Your message appears to involve dark web or illegal content. "
+    "For safety and compliance, I can’t assist with that. "
+    "Please stick to legal topics like Streamlit, FastAPI, or general programming."
+)
+TOPIC_GUARD_REPLY = (
+    "Sorry, I can only discuss topics related to Streamlit, "
+    "FastAPI, or general programming. Please adjust your question."
+)
+READING_TIME_GUARD_REPLY = (
+    "The generated answer would take longer than 90 seconds to read. "
+    "Please simplify or narrow down your question so I can provide a "
+    "concise and focused response."
+)
+
+# Rough word budget for the 90 second reading-time limit (~180 words per minute);
+# replies at or below it are never long enough to fail the ReadingTime guardrail
+READING_TIME_MAX_WORDS = 270
+
+# Guards are built once at import so every request reuses the same validators
+READING_TIME_GUARD = Guard().use(
+    ReadingTime,
+    reading_time=90 / 60,  # reading_time is in minutes
+    on_fail=OnFailAction.EXCEPTION
+)
+
+TOPIC_GUARD = Guard().use(
+    RestrictToTopic(
+        valid_topics=["streamlit", "fastapi", "API", "Langfuse"],
+        invalid_topics=["politics", "music", "sports"],
+        disable_classifier=True,
+        disable_llm=False,
         on_fail=OnFailAction.EXCEPTION
     )
+)
+
+
+def within_reading_time_budget(text: str) -> bool:
+    return len(text.split()) <= READING_TIME_MAX_WORDS
+
+
+def apply_reading_time_guardrail(response_text: str):
+    """Ensure the assistant's response can be read in under 90 seconds."""
+    # Short replies are well within the limit, so skip the validator entirely
+    if within_reading_time_budget(response_text):
+        return response_text
 
     try:
-        return guard.validate(response_text)
+        return READING_TIME_GUARD.validate(response_text)
     except Exception as e:
-        print("[Guardrail: ReadingTime] Triggered:", e)
+        logger.info("[Guardrail: ReadingTime] Triggered: %s", e)
         return "GUARDRAILS ERROR"
 
 
+# Keyword preflight for the topic guardrail; only ambiguous prompts reach the LLM check
+TOPIC_ALLOW_TOKENS = frozenset({"streamlit", "fastapi", "api", "apis", "langfuse", "programming"})
+TOPIC_DENY_TOKENS = frozenset({
+    "politics", "political", "politician", "politicians",
+    "music", "musical", "musician", "musicians",
+    "sport", "sports",
+})
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+
 def apply_topic_guardrail(prompt: str):
     """Restrict all conversations to Streamlit, FastAPI, and Programming."""
-    guard = Guard().use(
-        RestrictToTopic(
-            valid_topics=["streamlit", "fastapi", "API", "Langfuse"],
-            invalid_topics=["politics", "music", "sports"],
-            disable_classifier=True,
-            disable_llm=False,
-            on_fail=OnFailAction.EXCEPTION
-        )
-    )
+    tokens = set(TOKEN_PATTERN.findall(prompt.lower()))
+    if not tokens.isdisjoint(TOPIC_DENY_TOKENS):
+        logger.info("[Guardrail: RestrictToTopic] Triggered by keyword preflight")
+        return "GUARDRAILS ERROR"
+    if not tokens.isdisjoint(TOPIC_ALLOW_TOKENS):
+        return prompt
 
     try:
-        return guard.validate(prompt)
+        return TOPIC_GUARD.validate(prompt)
     except Exception as e:
-        print("[Guardrail: RestrictToTopic] Triggered:", e)
+        logger.info("[Guardrail: RestrictToTopic] Triggered: %s", e)
         return "GUARDRAILS ERROR"
 
 
@@ -145,37 +261,62 @@ def dark_web_check(value: str, metadata: dict) -> ValidationResult:
         return PassResult()
 
 
+DARKWEB_GUARD = Guard().use("dark-web-check", on_fail=OnFailAction.EXCEPTION)
+
+
 def apply_darkweb_guardrail(text: str):
     """Apply custom dark web validator to a message or AI response."""
-    guard = Guard().use("dark-web-check", on_fail=OnFailAction.EXCEPTION)
     try:
-        return guard.validate(text)
+        return DARKWEB_GUARD.validate(text)
     except Exception as e:
-        print("[Guardrail] Dark web content detected:", e)
+        logger.info("[Guardrail] Dark web content detected: %s", e)
         return "GUARDRAILS ERROR"
 
 
+# One pooled HTTP client for Tavily's REST API keeps TCP/TLS connections alive between searches
+TAVILY_SEARCH_URL = "https://api.tavily.com/search"
+TAVILY_HTTP = httpx.AsyncClient(
+    headers={"Authorization": f"Bearer {TAVILY_API_KEY}"},
+    timeout=30,
+) if TAVILY_API_KEY else None
+
+# Recent Tavily results keyed by normalized query; only touched from the event loop
+TAVILY_TTL = 300  # seconds
+_TAVILY_CACHE: TTLCache = TTLCache(maxsize=1024, ttl=TAVILY_TTL)
+
+
 def build_tools():
     """Create helper tools the agent can call, including Tavily search."""
     if tool is None:
         return []
 
     @tool
-    def tavily_search(query: str) -> str:
+    async def tavily_search(query: str) -> str:
         """Perform a web search using Tavily and summarize key sources."""
         if not TAVILY_API_KEY:
             return "Tavily API key not configured."
-        client = TavilyClient(api_key=TAVILY_API_KEY)
-        print("[Tool] tavily_search called")
+        logger.info("[Tool] tavily_search called")
+
+        key = query.strip().lower()
+        cached = _TAVILY_CACHE.get(key)
+        if cached is not None:
+            logger.info("[Tool] tavily_search cache hit")
+            return cached
+
         try:
-            results = client.search(query)
+            response = await TAVILY_HTTP.post(TAVILY_SEARCH_URL, json={"query": query})
+            response.raise_for_status()
+            results = response.json()
             snippets = []
             for item in results.get("results", [])[:3]:
                 snippets.append(f"- {item.get('title', '')}: {item.get('url', '')}")
-            return "Tavily search results:\n" + "\n".join(snippets)
+            text = "Tavily search results:\n" + "\n".join(snippets)
         except Exception as e:
             return f"Error calling Tavily: {e}"
 
+        _TAVILY_CACHE[key] = text
+        return text
+
     return [tavily_search]
 
 
@@ -193,18 +334,21 @@ def build_agent_runner():
         llm = ChatOpenAI(model=OPENAI_MODEL, temperature=0, api_key=OPENAI_API_KEY)
         return create_react_agent(llm, tools)
     except Exception as exc:  # keep the API functional without the agent
-        print(f"[LangGraph] could not create agent, using rule-based replies. Error: {exc}")
+        logger.warning("[LangGraph] could not create agent, using rule-based replies. Error: %s", exc)
         return None
 
 
 agent_runner = build_agent_runner()
 
+# Langfuse CallbackHandler for Langchain (tracing), shared by every agent run
+LANGFUSE_CALLBACK = CallbackHandler()
 
-def run_agent(message: str, system_prompt: Optional[str] = None) -> Optional[str]:
-    """Ask the LangGraph agent for a reply; return None if unavailable."""
 
-    # Initialize Langfuse CallbackHandler for Langchain (tracing)
-    langfuse_handler = CallbackHandler()
+_get_messages = operator.itemgetter("messages")
+
+
+async def run_agent(message: str, system_prompt: Optional[str] = None) -> Optional[str]:
+    """Ask the LangGraph agent for a reply; return None if unavailable."""
 
     if agent_runner is None:
         return None
@@ -215,16 +359,19 @@ def run_agent(message: str, system_prompt: Optional[str] = None) -> Optional[str
     messages.append(("user", message))
 
     try:
-        result = agent_runner.invoke({"messages": messages}, config={"callbacks": [langfuse_handler]})
+        result = await agent_runner.ainvoke({"messages": messages}, config={"callbacks": [LANGFUSE_CALLBACK]})
     except Exception as exc:  # fall back to rule-based helper on errors
-        print(f"[LangGraph] agent invocation failed: {exc}")
+        logger.warning("[LangGraph] agent invocation failed: %s", exc)
         return None
 
-    messages = result.get("messages") if isinstance(result, dict) else None
-    if not messages:
+    try:
+        result_messages = _get_messages(result)
+    except (TypeError, KeyError):
+        return None
+    if not result_messages:
         return None
 
-    last_message = messages[-1]
+    last_message = result_messages[-1]
     content = getattr(last_message, "content", last_message)
     return _content_to_text(content)
 
@@ -233,37 +380,61 @@ def _content_to_text(content: Any) -> Optional[str]:
     if isinstance(content, str):
         return content
     if isinstance(content, list):
-        chunks = []
-        for item in content:
-            if isinstance(item, dict) and "text" in item:
-                chunks.append(str(item["text"]))
-            elif isinstance(item, str):
-                chunks.append(item)
-        return "\n".join(chunks).strip() if chunks else None
+        text = "\n".join(
+            item if isinstance(item, str) else str(item["text"])
+            for item in content
+            if isinstance(item, str) or (isinstance(item, dict) and "text" in item)
+        )
+        return text.strip() or None
     if isinstance(content, dict) and "text" in content:
         return str(content["text"])
     return str(content) if content is not None else None
 
 
 # --- Fallback replies ------------------------------------------------------
+KEY_TO_REPLY = {
+    "streamlit_reply": "Streamlit reruns your script after every click. Keep anything you need in st.session_state.",
+    "fastapi_reply": "FastAPI ships with automatic docs at /docs. Try them once the server is running!",
+    "monitor_reply": "Langfuse links inputs and outputs. Set the keys to see traces pop up in the dashboard.",
+    "deploy_reply": "Deploy the API first, then point your Streamlit app to the live URL to share it.",
+}
+OFFLINE_REPLY = "I am in offline mode. Ask about Streamlit, FastAPI, or Langfuse to see directed tips."
+
+# Keywords in priority order, matched in a single pass over the message
+FALLBACK_KEYWORDS = [
+    ("streamlit", "streamlit_reply"),
+    ("fastapi", "fastapi_reply"),
+    ("langfuse", "monitor_reply"),
+    ("monitor", "monitor_reply"),
+    ("deploy", "deploy_reply"),
+]
+
+
+def _build_fallback_automaton() -> ahocorasick.Automaton:
+    """Compile the fallback keywords into an automaton whose values carry their priority."""
+    automaton = ahocorasick.Automaton()
+    for priority, (keyword, reply_key) in enumerate(FALLBACK_KEYWORDS):
+        automaton.add_word(keyword, (priority, reply_key))
+    automaton.make_automaton()
+    return automaton
+
+
+FALLBACK_AUTOMATON = _build_fallback_automaton()
+
+
 def build_offline_reply(message: str) -> str:
-    text = message.lower()
-    if "streamlit" in text:
-        return "Streamlit reruns your script after every click. Keep anything you need in st.session_state."
-    if "fastapi" in text:
-        return "FastAPI ships with automatic docs at /docs. Try them once the server is running!"
-    if "langfuse" in text or "monitor" in text:
-        return "Langfuse links inputs and outputs. Set the keys to see traces pop up in the dashboard."
-    if "deploy" in text:
-        return "Deploy the API first, then point your Streamlit app to the live URL to share it."
-    return "I am in offline mode. Ask about Streamlit, FastAPI, or Langfuse to see directed tips."
-
-
-def invoke_agent(message: str, langfuse_client: Langfuse, session_id: str, system_prompt: Optional[str] = None) -> tuple[str, str]:
+    matches = [value for _, value in FALLBACK_AUTOMATON.iter(message.lower())]
+    if not matches:
+        return OFFLINE_REPLY
+    _, reply_key = min(matches)
+    return KEY_TO_REPLY[reply_key]
+
+
+async def invoke_agent(message: str, langfuse_client: Langfuse, session_id: str, system_prompt: Optional[str] = None) -> tuple[str, str]:
     with langfuse_client.start_as_current_span(name="🤖-fastapi-agent") as span:
         span.update_trace(input=message, session_id=session_id)
 
-        agent_reply = run_agent(message, system_prompt)
+        agent_reply = await run_agent(message, system_prompt)
 
         span.update_trace(output=agent_reply)
 
@@ -272,25 +443,324 @@ def invoke_agent(message: str, langfuse_client: Langfuse, session_id: str, syste
     return build_offline_reply(message), "rule-based"
 
 
+# --- Response cache ---------------------------------------------------------
+# Tier 1: exact match on (system prompt hash, normalized message)
+# Tier 2: nearest neighbour on message embeddings for near-identical questions
+# Both tiers are only touched from the event loop, so they need no lock
+RESPONSE_CACHE_TTL = 600  # seconds
+RESPONSE_CACHE_SIZE = 1024
+SEMANTIC_CACHE_THRESHOLD = 0.95
+SEMANTIC_CACHE_SIZE = 500
+EMBEDDING_MODEL = "text-embedding-3-small"
+EMBEDDING_DIM = 1536
+
+_RESPONSE_CACHE: TTLCache = TTLCache(maxsize=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL)
+
+# Semantic tier is a preallocated ring buffer; empty slots carry a -inf timestamp so they never match
+_SEMANTIC_VECTORS = np.zeros((SEMANTIC_CACHE_SIZE, EMBEDDING_DIM), dtype=np.float32)
+_SEMANTIC_TIMES = np.full(SEMANTIC_CACHE_SIZE, -np.inf)
+_SEMANTIC_PROMPTS = np.empty(SEMANTIC_CACHE_SIZE, dtype=object)
+_SEMANTIC_REPLIES: list[Optional[tuple[str, str]]] = [None] * SEMANTIC_CACHE_SIZE
+_semantic_next = 0
+_semantic_count = 0
+
+EMBEDDINGS = OpenAIEmbeddings(model=EMBEDDING_MODEL, api_key=OPENAI_API_KEY) if OPENAI_API_KEY else None
+
+
+def response_cache_key(message: str, system_prompt: str) -> tuple[str, str]:
+    prompt_hash = hashlib.sha256(system_prompt.encode()).hexdigest()
+    return prompt_hash, " ".join(message.lower().split())
+
+
+def get_cached_reply(key: tuple[str, str]) -> Optional[tuple[str, str]]:
+    return _RESPONSE_CACHE.get(key)
+
+
+async def embed_message(message: str) -> Optional[np.ndarray]:
+    """Return the unit-length embedding of a message; None if embeddings are unavailable."""
+    if EMBEDDINGS is None:
+        return None
+    try:
+        vector = np.asarray(await EMBEDDINGS.aembed_query(message), dtype=np.float32)
+    except Exception as exc:  # a failed lookup is just a cache miss
+        logger.warning("[Cache] embedding failed: %s", exc)
+        return None
+    if vector.shape != (EMBEDDING_DIM,):
+        return None
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else None
+
+
+def get_similar_cached_reply(prompt_hash: str, vector: Optional[np.ndarray]) -> Optional[tuple[str, str]]:
+    if vector is None or _semantic_count == 0:
+        return None
+
+    n = _semantic_count
+    live = (time.monotonic() - _SEMANTIC_TIMES[:n] < RESPONSE_CACHE_TTL) & (_SEMANTIC_PROMPTS[:n] == prompt_hash)
+    scores = np.where(live, _SEMANTIC_VECTORS[:n] @ vector, -1.0)
+    best = int(np.argmax(scores))
+    if scores[best] < SEMANTIC_CACHE_THRESHOLD:
+        return None
+    return _SEMANTIC_REPLIES[best]
+
+
+def store_cached_reply(key: tuple[str, str], vector: Optional[np.ndarray], reply: str, source: str) -> None:
+    global _semantic_next, _semantic_count
+
+    _RESPONSE_CACHE[key] = (reply, source)
+    if vector is None:
+        return
+
+    # Overwrite the oldest slot once the buffer is full
+    slot = _semantic_next
+    _SEMANTIC_VECTORS[slot] = vector
+    _SEMANTIC_TIMES[slot] = time.monotonic()
+    _SEMANTIC_PROMPTS[slot] = key[0]
+    _SEMANTIC_REPLIES[slot] = (reply, source)
+    _semantic_next = (slot + 1) % SEMANTIC_CACHE_SIZE
+    _semantic_count = min(_semantic_count + 1, SEMANTIC_CACHE_SIZE)
+
+
 # Generate token for authentication
-def create_token(username: str) -> str:
-    return f"token-{uuid4()}-{username}"
+def create_token() -> str:
+    return secrets.token_urlsafe(32)
 
 
 # Persist the token on the "memory" of the API
 def save_token(token: str, username: str) -> None:
-    app.state.active_tokens[token] = username
+    with app.state.active_tokens_lock:
+        app.state.active_tokens[token] = username
 
 
 # Validate if the token passed by the user matches the one that was generated by the API
 def verify_token(x_auth_token: str = Header(..., convert_underscores=False)) -> str:
-    username = app.state.active_tokens.get(x_auth_token)
+    with app.state.active_tokens_lock:
+        username = app.state.active_tokens.get(x_auth_token)
     if not username:
         raise HTTPException(status_code=401, detail="Missing or invalid authentication token")
     return username
 
 
+async def process_message(message: str, session_id: str, monitored: bool, langfuse_client: Langfuse) -> ChatResponse:
+    """Run one message through the guardrails, the response cache, and the agent."""
+
+    guard_darkweb_result = await asyncio.to_thread(apply_darkweb_guardrail, message)
+    if guard_darkweb_result == "GUARDRAILS ERROR":
+        logger.info("[Guardrail: DarkWeb] Dark web content detected.")
+        return ChatResponse(
+            reply=DARKWEB_GUARD_REPLY,
+            source="guardrail:darkweb",
+            monitored=False,
+            session_id=session_id
+        )
+
+    # An identical question already passed every guardrail, so its reply can be returned directly
+    cache_key = response_cache_key(message, SYSTEM_PROMPT)
+    cached = get_cached_reply(cache_key)
+    if cached:
+        reply, source = cached
+        return ChatResponse(
+            reply=reply,
+            source=f"cache:{source}",
+            monitored=monitored,
+            session_id=session_id
+        )
+
+    # Run the topic guardrail, the semantic cache lookup and the agent call side by side
+    topic_task = asyncio.create_task(asyncio.to_thread(apply_topic_guardrail, message))
+    agent_task = asyncio.create_task(
+        invoke_agent(
+            message=message,
+            langfuse_client=langfuse_client,
+            session_id=session_id,
+            system_prompt=SYSTEM_PROMPT
+        )
+    )
+    try:
+        message_vector = await embed_message(message)
+        similar = get_similar_cached_reply(cache_key[0], message_vector)
+        if similar:
+            # A near-identical question was already answered; the agent run is not needed
+            agent_task.cancel()
+
+        # Drop the agent call if the topic guardrail finds the topic off-limits
+        guard_topic_result = await topic_task
+        if guard_topic_result == "GUARDRAILS ERROR":
+            logger.info("[Guardrail] Restricted topic triggered.")
+            return ChatResponse(
+                reply=TOPIC_GUARD_REPLY,
+                source="guardrail:topic",
+                monitored=False,
+                session_id=session_id
+            )
+
+        if similar:
+            reply, source = similar
+            return ChatResponse(
+                reply=reply,
+                source=f"cache:{source}",
+                monitored=monitored,
+                session_id=session_id
+            )
+
+        reply, source = await agent_task
+    finally:
+        # Never leave the agent running unattended, e.g. when the client disconnects
+        # or a sibling message in /chat/batch fails; a no-op once it has finished
+        agent_task.cancel()
+
+    # Only replies over the word budget need the full validator, which runs off the event loop
+    if (
+        not within_reading_time_budget(reply)
+        and await asyncio.to_thread(apply_reading_time_guardrail, reply) == "GUARDRAILS ERROR"
+    ):
+        logger.info("[Guardrail] Reading time exceeded.")
+        return ChatResponse(
+            reply=READING_TIME_GUARD_REPLY,
+            source="guardrail:reading_time",
+            monitored=monitored,
+            session_id=session_id
+        )
+
+    # Only agent replies are cached; offline tips are cheap and should not outlive an outage
+    if source.startswith("langgraph:"):
+        store_cached_reply(cache_key, message_vector, reply, source)
+
+    return ChatResponse(
+        reply=reply,
+        source=source,
+        monitored=monitored,
+        session_id=session_id
+    )
+
+
+# --- Streaming --------------------------------------------------------------
+SENTENCE_END = re.compile(r"[.!?\n]\s*$")
+
+
+def sse_event(data: dict) -> str:
+    return f"data: {orjson.dumps(data).decode()}\n\n"
+
+
+async def exceeds_reading_time(text: str) -> bool:
+    return await asyncio.to_thread(apply_reading_time_guardrail, text) == "GUARDRAILS ERROR"
+
+
+async def stream_agent_sentences(message: str) -> AsyncIterator[str]:
+    """Stream the agent's answer, grouping tokens into whole sentences."""
+    messages = [("system", SYSTEM_PROMPT), ("user", message)]
+    pending = ""
+
+    async for chunk, metadata in agent_runner.astream(
+        {"messages": messages},
+        config={"callbacks": [LANGFUSE_CALLBACK]},
+        stream_mode="messages",
+    ):
+        # Only forward the model's answer, not tool calls or tool output
+        if metadata.get("langgraph_node") != "agent":
+            continue
+        text = _content_to_text(chunk.content)
+        if not text:
+            continue
+
+        pending += text
+        if SENTENCE_END.search(pending):
+            yield pending
+            pending = ""
+
+    if pending:
+        yield pending
+
+
+async def stream_message(message: str, session_id: str, monitored: bool, langfuse_client: Langfuse) -> AsyncIterator[str]:
+    """Yield Server-Sent Events for one message: validated sentences, then a closing summary event."""
+
+    guard_darkweb_result, guard_topic_result = await asyncio.gather(
+        asyncio.to_thread(apply_darkweb_guardrail, message),
+        asyncio.to_thread(apply_topic_guardrail, message),
+    )
+    if guard_darkweb_result == "GUARDRAILS ERROR" or guard_topic_result == "GUARDRAILS ERROR":
+        blocked = guard_darkweb_result == "GUARDRAILS ERROR"
+        logger.info("[Guardrail] Stream blocked before generation.")
+        response = ChatResponse(
+            reply=DARKWEB_GUARD_REPLY if blocked else TOPIC_GUARD_REPLY,
+            source="guardrail:darkweb" if blocked else "guardrail:topic",
+            monitored=False,
+            session_id=session_id
+        )
+        yield sse_event({"type": "guardrail", **response.model_dump()})
+        return
+
+    if agent_runner is None:
+        yield sse_event({"type": "token", "text": build_offline_reply(message)})
+        yield sse_event({"type": "done", "source": "rule-based", "monitored": monitored, "session_id": session_id})
+        return
+
+    reply = ""
+    with langfuse_client.start_as_current_span(name="🤖-fastapi-agent-stream") as span:
+        span.update_trace(input=message, session_id=session_id)
+
+        try:
+            async for sentence in stream_agent_sentences(message):
+                if await exceeds_reading_time(reply + sentence):
+                    logger.info("[Guardrail] Reading time exceeded while streaming.")
+                    span.update_trace(output=reply + sentence)
+                    response = ChatResponse(
+                        reply=READING_TIME_GUARD_REPLY,
+                        source="guardrail:reading_time",
+                        monitored=monitored,
+                        session_id=session_id
+                    )
+                    yield sse_event({"type": "guardrail", **response.model_dump()})
+                    return
+
+                reply += sentence
+                yield sse_event({"type": "token", "text": sentence})
+        except Exception as exc:  # fall back to rule-based helper on errors
+            logger.warning("[LangGraph] agent streaming failed: %s", exc)
+            if not reply:
+                yield sse_event({"type": "token", "text": build_offline_reply(message)})
+                yield sse_event({"type": "done", "source": "rule-based", "monitored": monitored, "session_id": session_id})
+                return
+
+            # Some sentences already went out, so tell the client the answer is truncated
+            span.update_trace(output=reply, metadata={"partial": True})
+            yield sse_event({
+                "type": "error",
+                "detail": "The agent stopped before finishing its answer.",
+                "source": f"langgraph:{OPENAI_MODEL}",
+                "monitored": monitored,
+                "session_id": session_id,
+            })
+            return
+
+        span.update_trace(output=reply)
+
+    yield sse_event({"type": "done", "source": f"langgraph:{OPENAI_MODEL}", "monitored": monitored, "session_id": session_id})
+
+
 # --- Routes -----------------------------------------------------------------
+@app.on_event("startup")
+async def check_langfuse() -> None:
+    # Verify the Langfuse connection once instead of on every chat request
+    try:
+        app.state.monitored = await asyncio.to_thread(get_client().auth_check)
+    except Exception as exc:  # bad credentials or no network should not stop the API from starting
+        logger.warning("Langfuse auth check failed: %s", exc)
+        app.state.monitored = False
+
+    if app.state.monitored:
+        logger.info("Langfuse client is authenticated and ready!")
+    else:
+        logger.warning("Authentication failed. Please check your credentials and host.")
+
+
+@app.on_event("shutdown")
+async def close_clients() -> None:
+    if TAVILY_HTTP is not None:
+        await TAVILY_HTTP.aclose()
+
+
 @app.get("/health")
 def health() -> dict:
     return {"status": "ok"}
@@ -298,92 +768,75 @@ def health() -> dict:
 
 @app.post("/login", response_model=LoginResponse)
 def login(credentials: LoginRequest) -> LoginResponse:
-    if not AGENT_API_USERNAME or not AGENT_API_PASSWORD:
+    if _USER_DIGEST is None or _PWD_DIGEST is None:
         raise HTTPException(status_code=500, detail="Server credentials are not configured")
 
-    if credentials.username != AGENT_API_USERNAME or credentials.password != AGENT_API_PASSWORD:
+    # Check both fields every time so the response time does not reveal which one was wrong
+    user_ok = hmac.compare_digest(hashlib.sha256(credentials.username.encode()).digest(), _USER_DIGEST)
+    pwd_ok = hmac.compare_digest(hashlib.sha256(credentials.password.encode()).digest(), _PWD_DIGEST)
+    if not (user_ok & pwd_ok):
         raise HTTPException(status_code=401, detail="Invalid username or password")
 
-    token = create_token(credentials.username)
+    token = create_token()
     save_token(token, credentials.username)
     return LoginResponse(message=f"Welcome back, {credentials.username}!", token=token)
 
 
 @app.post("/chat", response_model=ChatResponse)
-def chat(payload: ChatRequest, username: str = Depends(verify_token)) -> ChatResponse:
+async def chat(payload: ChatRequest, username: str = Depends(verify_token)) -> ORJSONResponse:
     """Main chat endpoint with topic and reading-time guardrails."""
 
     message = payload.message.strip()
     if not message:
         raise HTTPException(status_code=400, detail="message cannot be empty")
 
-    session_id = payload.session_id
+    session_id = payload.session_id or str(uuid4())
 
     langfuse_client = get_client()
-    if langfuse_client.auth_check():
-        print("Langfuse client is authenticated and ready!")
-        monitored = True
-    else:
-        print("Authentication failed. Please check your credentials and host.")
-        monitored = False
+    monitored = app.state.monitored
 
-    guard_darkweb_result = apply_darkweb_guardrail(message)
-    if guard_darkweb_result == "GUARDRAILS ERROR":
-        print("[Guardrail: DarkWeb] Dark web content detected.")
-        return ChatResponse(
-            reply=(
-                "Your message appears to involve dark web or illegal content. "
-                "For safety and compliance, I can’t assist with that. "
-                "Please stick to legal topics like Streamlit, FastAPI, or general programming."
-            ),
-            source="guardrail:darkweb",
-            monitored=False,
-            session_id=session_id
-        )
+    chat_response = await process_message(message, session_id, monitored, langfuse_client)
+    # ChatResponse is already validated; returning a Response skips FastAPI's second validation pass
+    return ORJSONResponse(content=chat_response.model_dump())
 
-    guard_topic_result = apply_topic_guardrail(message)
-    if guard_topic_result == "GUARDRAILS ERROR":
-        print("[Guardrail] Restricted topic triggered.")
-        return ChatResponse(
-            reply=(
-                "Sorry, I can only discuss topics related to Streamlit, "
-                "FastAPI, or general programming. Please adjust your question."
-            ),
-            source="guardrail:topic",
-            monitored=False,
-            session_id=session_id
-        )
 
-    SYSTEM_PROMPT = """
-        You are a deployment assistant for Class 6 demos. 
-        Explain environment setup, FastAPI backend deployment, and Streamlit UI integration clearly. 
-        Use the Tavily search tool for recent context and cite sources when useful. 
-    """
-
-    reply, source = invoke_agent(
-        message=message,
-        langfuse_client=langfuse_client,
-        session_id=session_id,
-        system_prompt=SYSTEM_PROMPT
-    )
+@app.post("/chat/batch", response_model=BatchChatResponse)
+async def chat_batch(payload: BatchChatRequest, username: str = Depends(verify_token)) -> ORJSONResponse:
+    """Answer up to BATCH_MAX_MESSAGES messages, BATCH_CONCURRENCY at a time, in one session."""
 
-    guard_length_result = apply_reading_time_guardrail(reply)
-    if guard_length_result == "GUARDRAILS ERROR":
-        print("[Guardrail] Reading time exceeded.")
-        return ChatResponse(
-            reply=(
-                "The generated answer would take longer than 90 seconds to read. "
-                "Please simplify or narrow down your question so I can provide a "
-                "concise and focused response."
-            ),
-            source="guardrail:reading_time",
-            monitored=monitored,
-            session_id=session_id
-        )
+    messages = [message.strip() for message in payload.messages]
+    if not all(messages):
+        raise HTTPException(status_code=400, detail="messages cannot contain empty strings")
 
-    return ChatResponse(
-        reply=reply,
-        source=source,
-        monitored=monitored,
-        session_id=session_id
+    session_id = payload.session_id or str(uuid4())
+
+    langfuse_client = get_client()
+    monitored = app.state.monitored
+
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+    async def process_limited(message: str) -> ChatResponse:
+        async with semaphore:
+            return await process_message(message, session_id, monitored, langfuse_client)
+
+    responses = await asyncio.gather(*(process_limited(message) for message in messages))
+    return ORJSONResponse(content=BatchChatResponse(responses=list(responses)).model_dump())
+
+
+@app.post("/chat/stream")
+async def chat_stream(payload: ChatRequest, username: str = Depends(verify_token)) -> StreamingResponse:
+    """Stream the agent reply as Server-Sent Events, checking reading time sentence by sentence."""
+
+    message = payload.message.strip()
+    if not message:
+        raise HTTPException(status_code=400, detail="message cannot be empty")
+
+    session_id = payload.session_id or str(uuid4())
+
+    langfuse_client = get_client()
+    monitored = app.state.monitored
+
+    return StreamingResponse(
+        stream_message(message, session_id, monitored, langfuse_client),
+        media_type="text/event-stream"
     )